@@ -3,27 +3,80 @@
 import os
 import sqlite3
 import json
+import datetime
+from operator import itemgetter
+from functools import lru_cache
+import tempfile
 import platform
-import re
 from pathlib import Path
 import argparse
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 
-# Command type mapping
-COMMAND_TYPES = {
-    1: "chat",
-    2: "completion",
-    3: "insert",
-    4: "edit",
-    5: "delete",
-    6: "format",
-    7: "explain",
-    8: "test",
-    9: "fix",
-    10: "optimize"
-}
+# Prefer a C JSON parser for the (often multi-megabyte) prompt blobs
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+# Match workspace file names in prompts with a single Aho-Corasick pass
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Placeholder values Cursor stores when there are no prompts
+EMPTY_PROMPT_VALUES = frozenset(('[]', 'null', '""', b'[]', b'null', b'""'))
+
+# Command type mapping, indexed by Cursor's numeric commandType (1-10)
+COMMAND_TYPES = (
+    None,
+    "chat",
+    "completion",
+    "insert",
+    "edit",
+    "delete",
+    "format",
+    "explain",
+    "test",
+    "fix",
+    "optimize"
+)
+
+# ISO 8601 forms that datetime.fromisoformat rejects before Python 3.11,
+# e.g. 2-digit fractions or "+0000" offsets
+ISO_TIMESTAMP_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S"
+)
+
+# File extensions of candidate Cursor databases
+DB_EXTENSIONS = ('.vscdb', '.db')
 
+# Compact JSON encoding used for the log's raw data and the prompt spool file
+encode_json = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+# Header every SQLite 3 database file starts with
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+# Only keep prompts that mention a workspace file; while this is off every prompt
+# is kept and the workspace is never walked
+FILTER_BY_WORKSPACE = False
+
+# Dependency and build output directories that are never descended into
+SKIPPED_WORKSPACE_DIRS = frozenset(('node_modules', '__pycache__', 'target', 'build', 'dist'))
+
+@lru_cache(maxsize=1)
 def get_cursor_storage_paths():
-    """Get all possible Cursor storage paths based on the operating system."""
+    """Get all possible Cursor storage paths based on the operating system.
+    
+    The result is cached, since it cannot change within a single run.
+    """
     system = platform.system()
     home = Path.home()
     paths = []
@@ -57,12 +110,17 @@ def get_cursor_storage_paths():
     else:
         base_paths = [home]
     
-    # Add all possible combinations
-    for base in base_paths:
+    # Add all possible combinations, skipping base directories that don't exist
+    # (plain strings, so no Path objects are built for candidates that don't exist)
+    existing_bases = [str(base) + os.sep for base in base_paths if base.is_dir()]
+    for base in existing_bases:
         for common in common_paths:
-            path = base / common
-            if path.exists():
-                paths.append(path)
+            path = base + common
+            try:
+                os.stat(path)
+            except OSError:
+                continue
+            paths.append(Path(path))
     
     # Add custom path from environment variable if set
     custom_path = os.environ.get('CURSOR_STORAGE_PATH')
@@ -71,7 +129,12 @@ def get_cursor_storage_paths():
         if custom_path.exists():
             paths.append(custom_path)
     
-    return paths
+    # Drop paths that resolve to the same location (e.g. via symlinks) so their
+    # trees are only walked once
+    unique_paths = {}
+    for path in paths:
+        unique_paths.setdefault(os.path.realpath(path), path)
+    return tuple(unique_paths.values())
 
 def find_cursor_dbs():
     """Find all potential Cursor database files."""
@@ -80,103 +143,202 @@ def find_cursor_dbs():
         if base_path.is_file():
             db_files.append(str(base_path))
         else:
-            for root, dirs, files in os.walk(base_path):
-                for file in files:
-                    if file.endswith('.vscdb') or file.endswith('.db'):
-                        full_path = os.path.join(root, file)
-                        try:
-                            with sqlite3.connect(full_path) as conn:
-                                conn.execute("SELECT 1")
-                            db_files.append(full_path)
-                        except sqlite3.Error:
-                            continue
+            stack = [str(base_path)]
+            while stack:
+                directory = stack.pop()
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.name.endswith(DB_EXTENSIONS) and entry.is_file(follow_symlinks=False):
+                                try:
+                                    with open(entry.path, 'rb') as fh:
+                                        if fh.read(16) == SQLITE_MAGIC:
+                                            db_files.append(entry.path)
+                                except OSError:
+                                    continue
+                except OSError:
+                    continue  # Unreadable directory, same as os.walk's default
     
     return db_files
 
 def get_project_files(workspace_path):
-    """Get all files in the workspace."""
+    """Get all files in the workspace.
+    
+    Hidden directories and SKIPPED_WORKSPACE_DIRS are not descended into.
+    """
     files = set()
-    for root, _, filenames in os.walk(workspace_path):
-        for filename in filenames:
-            if not filename.startswith('.'):  # Skip hidden files
-                rel_path = os.path.relpath(os.path.join(root, filename), workspace_path)
-                files.add(rel_path.lower())  # Store lowercase for case-insensitive matching
+    if not FILTER_BY_WORKSPACE:
+        return files
+    
+    workspace_path = str(workspace_path)
+    stack = [workspace_path]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):  # Skip hidden files and directories
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIPPED_WORKSPACE_DIRS:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        rel_path = os.path.relpath(entry.path, workspace_path)
+                        files.add(rel_path)
+        except OSError:
+            continue
     return files
 
-def is_prompt_related_to_workspace(prompt_text, workspace_files):
+def build_workspace_matcher(workspace_files):
+    """Build a function reporting whether lowercased text mentions a workspace file.
+    
+    File names are lowercased once here rather than per prompt, and with
+    pyahocorasick installed all of them are found in a single pass over the text.
+    """
+    patterns = {file.lower() for file in workspace_files}
+    if not patterns:
+        return lambda text: False
+    
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for pattern in patterns:
+            automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    
+    return lambda text: any(pattern in text for pattern in patterns)
+
+def is_prompt_related_to_workspace(prompt_text, workspace_matcher):
     """Check if a prompt is related to the current workspace."""
-    prompt_text = prompt_text.lower()  # Convert to lowercase for case-insensitive matching
+    if not FILTER_BY_WORKSPACE:
+        return True  # See all prompts
     
-    # Always return True for now to see all prompts
-    return True
+    # Code blocks are part of the prompt text, so one search covers them too
+    return workspace_matcher(prompt_text.lower())  # Case-insensitive matching
+
+def timestamp_sort_key(timestamp):
+    """Convert a prompt timestamp (epoch seconds/milliseconds or ISO 8601) to epoch seconds."""
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        # Cursor sometimes stores milliseconds since the epoch
+        return timestamp / 1000 if timestamp > 1e11 else float(timestamp)
+    if not isinstance(timestamp, str):
+        return 0.0
     
-    # Original filtering logic (commented out for debugging)
-    """
-    # Check for workspace files in the prompt
-    for file in workspace_files:
-        if file in prompt_text:
-            return True
-    
-    # Check for code blocks that might contain workspace files
-    if '```' in prompt_text:
-        code_blocks = re.findall(r'```(?:[a-z]*\n)?(.*?)```', prompt_text, re.DOTALL)
-        for block in code_blocks:
-            block = block.lower()
-            for file in workspace_files:
-                if file in block:
-                    return True
-    
-    return False
-    """
+    try:
+        return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        pass
+    for fmt in ISO_TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(timestamp, fmt).timestamp()
+        except ValueError:
+            continue
+    return 0.0
 
-def extract_prompts_from_value(value, workspace_files):
+def extract_prompts_from_value(value, workspace_matcher):
     """Extract prompts from the aiService.prompts value."""
+    if not value or value in EMPTY_PROMPT_VALUES:
+        return []  # Nothing to parse
+    
     try:
-        prompts_data = json.loads(value)
+        prompts_data = json_loads(value)
         if not isinstance(prompts_data, list):
             return []
             
         extracted_prompts = []
-        for prompt in reversed(prompts_data):  # Process in reverse to get most recent first
+        for prompt in prompts_data:
             if isinstance(prompt, dict) and 'text' in prompt:
-                if prompt['text'].strip():
+                if prompt['text'].strip() and is_prompt_related_to_workspace(prompt['text'], workspace_matcher):
                     command_type = prompt.get('commandType', 'unknown')
-                    if isinstance(command_type, int) and command_type in COMMAND_TYPES:
+                    if isinstance(command_type, int) and 0 < command_type < len(COMMAND_TYPES):
                         command_type = COMMAND_TYPES[command_type]
                     
                     
                     extracted_prompts.append({
                         'content': prompt['text'],
                         'command_type': command_type,
+                        'sort_key': timestamp_sort_key(prompt.get('timestamp')),
                         'raw_data': prompt
                     })
         
         return extracted_prompts
-    except json.JSONDecodeError:
+    except ValueError:  # JSONDecodeError for json/orjson, ValueError for ujson
         return []
 
+def connect_readonly(db_path):
+    """Open a database read-only.
+    
+    mode=ro still takes SQLite's shared locks and reads the -wal file, so prompts
+    a running Cursor hasn't checkpointed yet are seen. immutable=1 ignores both
+    and is only used as a fallback for databases that can't be opened that way.
+    """
+    uri = Path(os.path.abspath(db_path)).as_uri()
+    conn = sqlite3.connect(uri + "?mode=ro", uri=True)
+    try:
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1")  # The file is only opened on first use
+    except sqlite3.OperationalError:
+        conn.close()
+        conn = sqlite3.connect(uri + "?mode=ro&immutable=1", uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    return conn
+
+def extract_prompts_from_db(db_path, workspace_matcher):
+    """Extract prompts from a database, returning one list of prompts per row.
+    
+    Runs in a worker thread, so it opens (and closes) its own connection.
+    """
+    rows = []
+    with closing(connect_readonly(db_path)) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM ItemTable WHERE key = 'aiService.prompts'")
+        for (value,) in cursor:  # Stream rows rather than fetchall()
+            rows.append(extract_prompts_from_value(value, workspace_matcher))
+    return rows
+
+def spool_prompt(spool, prompt):
+    """Append a prompt to the spool file as a JSON line and return its offset."""
+    offset = spool.tell()
+    record = {
+        'content': prompt['content'],
+        'command_type': prompt['command_type'],
+        'raw_data': prompt['raw_data']
+    }
+    spool.write(encode_json(record).encode('utf-8') + b"\n")
+    return offset
+
+def iter_spooled_prompts(spool, offsets):
+    """Read prompts back from the spool file one at a time, in the given order."""
+    for offset in offsets:
+        spool.seek(offset)
+        yield json_loads(spool.readline())
+
 def write_prompts_to_log(prompts, workspace_path, output_file="cursor-prompts.log"):
     """Write prompts to the log file."""
     if not prompts:
         return False
     
+    separator = "-" * 80 + "\n\n"
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
             f.write(f"Workspace: {workspace_path}\n")
             f.write("=" * 80 + "\n\n")
             
             for prompt in prompts:
-                f.write(f"Command Type: {prompt.get('command_type', 'Unknown')}\n")
-                f.write("Content:\n")
-                f.write(f"{prompt.get('content', 'No content')}\n")
-                
-                # Write raw data
-                f.write("\nRaw Data:\n")
-                raw_data = prompt.get('raw_data', {})
-                for key, value in raw_data.items():
-                    f.write(f"{key}: {json.dumps(value, indent=2)}\n")
-                
-                f.write("-" * 80 + "\n\n")
+                parts = [
+                    f"Command Type: {prompt.get('command_type', 'Unknown')}\n",
+                    "Content:\n",
+                    f"{prompt.get('content', 'No content')}\n",
+                    "\nRaw Data:\n",
+                    # One compact document, so the C encoder handles it in a single call
+                    encode_json(prompt.get('raw_data', {})),
+                    "\n",
+                    separator
+                ]
+                f.writelines(parts)
         
         return True
     except IOError:
@@ -197,10 +359,11 @@ def main():
         if args.verbose:
             print(f"Current workspace: {workspace_path}")
         
-        # Get workspace files (still needed for potential future filtering)
+        # Get workspace files (only walked when workspace filtering is enabled)
         workspace_files = get_project_files(workspace_path)
-        if args.verbose:
+        if args.verbose and FILTER_BY_WORKSPACE:
             print(f"Found {len(workspace_files)} files in workspace")
+        workspace_matcher = build_workspace_matcher(workspace_files)
         
         # Find Cursor databases
         db_files = find_cursor_dbs()
@@ -210,35 +373,51 @@ def main():
         
         print(f"Found {len(db_files)} database files")
         
-        # Extract prompts
-        all_prompts = []
-        for db_path in db_files:
-            try:
-                with sqlite3.connect(db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT * FROM ItemTable WHERE key = 'aiService.prompts'")
-                    rows = cursor.fetchall()
-                    
-                    print(f"\nProcessing database: {db_path}")
-                    print(f"Found {len(rows)} rows with prompts")
-                    
-                    for row in rows:
-                        row_dict = dict(zip([col[0] for col in cursor.description], row))
-                        if 'value' in row_dict:
-                            prompts = extract_prompts_from_value(row_dict['value'], workspace_files)
+        # Extract prompts in worker threads, keeping at most one database per
+        # worker in flight so finished results don't pile up waiting their turn.
+        # Prompts are spooled to a temporary file as each database is consumed,
+        # so only their sort keys and file offsets stay in memory.
+        index = []
+        workers = min(8, len(db_files))
+        with tempfile.TemporaryFile() as spool:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(extract_prompts_from_db, db_path, workspace_matcher)
+                           for db_path in db_files[:workers]]
+                for i, db_path in enumerate(db_files):
+                    future = futures[i]
+                    futures[i] = None  # Release this database's prompts once spooled
+                    try:
+                        rows = future.result()
+                    except sqlite3.Error as e:
+                        print(f"Error processing database {db_path}: {e}")
+                    else:
+                        print(f"\nProcessing database: {db_path}")
+                        print(f"Found {len(rows)} rows with prompts")
+                        
+                        for prompts in rows:
                             print(f"Extracted {len(prompts)} prompts from this row")
-                            all_prompts.extend(prompts)
-            except sqlite3.Error as e:
-                print(f"Error processing database {db_path}: {e}")
-                continue
-        
-        print(f"\nTotal prompts found: {len(all_prompts)}")
-        
-        # Write prompts to log
-        if write_prompts_to_log(all_prompts, workspace_path, args.output):
-            print(f"\nSuccessfully wrote {len(all_prompts)} prompts to {args.output}")
-        else:
-            print("\nNo prompts found")
+                            for prompt in prompts:
+                                index.append((prompt['sort_key'], spool_prompt(spool, prompt)))
+                        del rows
+                    
+                    # Refill the freed slot
+                    if i + workers < len(db_files):
+                        futures.append(executor.submit(extract_prompts_from_db,
+                                                       db_files[i + workers], workspace_matcher))
+            
+            print(f"\nTotal prompts found: {len(index)}")
+            
+            # Most recent first. Cursor stores prompts oldest first, so sorting
+            # ascending and reversing once also puts untimestamped prompts newest first
+            index.sort(key=itemgetter(0))
+            index.reverse()
+            
+            # Write prompts to log
+            prompts = iter_spooled_prompts(spool, map(itemgetter(1), index)) if index else []
+            if write_prompts_to_log(prompts, workspace_path, args.output):
+                print(f"\nSuccessfully wrote {len(index)} prompts to {args.output}")
+            else:
+                print("\nNo prompts found")
             
     except Exception as e:
         print(f"Error: {e}")